@@ -1,11 +1,33 @@
+import functools
+import threading
 from google.cloud import secretmanager
 
+# Shared client, created on first use (it opens a gRPC channel and loads credentials).
+# Vests run on a thread pool, so creation is locked to never build two channels.
+_sm_client = None
+_sm_client_lock = threading.Lock()
+
+
+def _get_sm():
+    global _sm_client
+    if _sm_client is None:
+        with _sm_client_lock:
+            if _sm_client is None:
+                _sm_client = secretmanager.SecretManagerServiceClient()
+    return _sm_client
+
 
 # Helper function to fetch a secret from GCP's Secret Manager
+# Each (project_id, secret_id, version_id) is only resolved once per process
+@functools.lru_cache(maxsize=None)
 def access_secret(project_id, secret_id, version_id):
 
-    client = secretmanager.SecretManagerServiceClient()
     name = f"projects/{project_id}/secrets/{secret_id}/versions/{version_id}"
-    response = client.access_secret_version(request={"name": name})
+    response = _get_sm().access_secret_version(request={"name": name})
+
+    return response.payload.data.decode('UTF-8')
+
 
-    return response.payload.data.decode('UTF-8')
\ No newline at end of file
+# Drops the cached secrets so the next access fetches the latest versions again
+def refresh_secrets():
+    access_secret.cache_clear()
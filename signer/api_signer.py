@@ -1,18 +1,26 @@
-import ecdsa
-import hashlib
+import functools
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
 from secret_manager.gcp_secret_manager import access_secret
 
+
+# Parsing the PEM is the slow part of signing, so the key is parsed once per PEM.
+# Keying on the PEM content means a rotated secret (see refresh_secrets) is picked up.
+@functools.lru_cache(maxsize=1)
+def _load_signing_key(pem_content):
+    return serialization.load_pem_private_key(pem_content.encode(), password=None)
+
+
+# payload is the bytes to sign (path|timestamp|request body)
 def sign(payload, project):
 
     ## Fetch secret from GCP's Secret Manager
     API_SIGNER_CLIENT_KEYPAIR = 'PRIVATE_KEY_FILE'
     pem_content = access_secret(project, API_SIGNER_CLIENT_KEYPAIR, 'latest') # CHANGE
 
-    # Signs the payload
-    signing_key = ecdsa.SigningKey.from_pem(pem_content)
+    # Signs the payload (OpenSSL-backed ECDSA, DER-encoded signature)
+    signing_key = _load_signing_key(pem_content)
 
-    signature = signing_key.sign(
-        data=payload.encode(), hashfunc=hashlib.sha256, sigencode=ecdsa.util.sigencode_der
-    )
+    signature = signing_key.sign(payload, ec.ECDSA(hashes.SHA256()))
 
-    return signature
\ No newline at end of file
+    return signature
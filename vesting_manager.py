@@ -1,10 +1,25 @@
 import schedule
 import time
-import pytz
+import logging
+import logging.handlers
+import queue
+import signal
+import threading
+import os
+import json
+import hashlib
+import stat
+import argparse
 import firebase_admin
-from datetime import datetime, timedelta
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from zoneinfo import ZoneInfo
 from vesting_scripts.transfer_native_gcp import transfer_native_gcp
 from vesting_scripts.transfer_token_gcp import transfer_token_gcp
+from vesting_scripts.fordefi_api import VEST_WORKERS
+from secret_manager.gcp_secret_manager import refresh_secrets
 from firebase_admin import firestore
 
 # -------------------------------------------------
@@ -14,151 +29,466 @@ from firebase_admin import firestore
 # for easier management.
 # -------------------------------------------------
 
-def load_vesting_configs():
+_log = logging.getLogger("vesting")
+
+# Vesting times are CET wall-clock times. We use the IANA zone rather than the
+# legacy "CET" alias so CET/CEST switches are always applied.
+_CET_NAME = "Europe/Paris"
+_CET = ZoneInfo(_CET_NAME)
+
+# Vests are network-bound (Secret Manager + Fordefi API), so they run on a
+# small thread pool instead of blocking the scheduler loop one after another.
+# The Fordefi HTTP connection pool is sized from the same VEST_WORKERS.
+_VEST_POOL = ThreadPoolExecutor(max_workers=VEST_WORKERS, thread_name_prefix="vest")
+
+# Set by the SIGTERM/SIGINT handlers to stop the scheduler loop
+_stop = threading.Event()
+
+# Configs fetched from Firestore are cached on disk so quick restarts
+# (crash loops, container restarts) don't re-read the whole collection.
+_CONFIG_CACHE_TTL = 3600  # seconds
+# Bumped whenever the cache layout changes, so older files are ignored
+_CONFIG_CACHE_VERSION = 2
+# The cache holds vault IDs, destinations and amounts, so it lives in a
+# directory only the service user can enter, never in the shared temp dir.
+_CONFIG_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "fordefi-vesting"
+)
+
+# Scheduled vest jobs per (vest_hour, vest_minute) slot, with the configs they
+# vest, so a refresh only replaces the slots whose configs changed.
+_SCHEDULED = {}
+
+# The _token_cfg dicts of each vault document, kept between refreshes so only
+# the documents whose 'updatedAt' moved past _LAST_SYNC are read again. Only
+# those fields are kept, never the raw Firestore values (timestamps, GeoPoints,
+# bytes...), so the cache always serializes to JSON.
+_CONFIG_CACHE = {}
+_LAST_SYNC = None
+
+# Edits that don't bump 'updatedAt' (e.g. made by hand in the console) are
+# invisible to a delta query, so the whole collection is still re-read on a
+# restart with a stale cache and at least this often.
+_FULL_SYNC_INTERVAL = 7 * 24 * 3600  # seconds
+_LAST_FULL_SYNC = None
+
+
+def _config_cache_path():
     """
-    Fetches vesting configurations from a Firestore collection named 'vesting_configs'.
-    Returns a list of config dictionaries.
+    Cache file for the current Firebase project, so different environments
+    on the same host don't read each other's configs.
+
+    Returns None (no caching) if _CONFIG_CACHE_DIR isn't a real directory owned
+    by the service user.
+    """
+    try:
+        os.makedirs(_CONFIG_CACHE_DIR, mode=0o700, exist_ok=True)
+        st = os.lstat(_CONFIG_CACHE_DIR)
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+            _log.warning("Not caching configs: %s is not a directory owned by this user.", _CONFIG_CACHE_DIR)
+            return None
+        if stat.S_IMODE(st.st_mode) & 0o077:
+            os.chmod(_CONFIG_CACHE_DIR, 0o700)
+    except OSError as e:
+        _log.warning("Not caching configs: %s", e)
+        return None
+
+    project_id = firebase_admin.get_app().project_id or "default"
+    digest = hashlib.sha1(project_id.encode()).hexdigest()[:8]
+    return os.path.join(_CONFIG_CACHE_DIR, f"vesting_configs_{digest}.json")
+
+
+@dataclass(slots=True, frozen=True)
+class VestCfg:
+    """
+    A validated vesting config, with the vesting time parsed when the config
+    is loaded.
+
+    cliff_days is carried over from Firestore but not enforced: the daily job
+    starts at the next vesting_time.
     """
-    db = firestore.client()
-    configs = []
+    vault_id: str
+    asset: str
+    asset_lower: str
+    ecosystem: str
+    type: str
+    chain: str
+    destination: str
+    value: str
+    note: str
+    cliff_days: int
+    vesting_time: str
+    vest_hour: int
+    vest_minute: int
+
+
+def _token_cfg(vault_id: str, token_info: dict):
+    """
+    Builds the config dictionary for one entry of a vault's 'tokens' array.
+    """
+    return {
+        "vault_id":     vault_id,
+        "asset":        token_info["asset"],
+        "ecosystem":    token_info["ecosystem"],
+        "type":         token_info["type"],
+        "chain":        token_info["chain"],
+        "destination":  token_info["destination"],
+        "value":        token_info["value"],
+        "note":         token_info["note"],
+        "cliff_days":   token_info["cliff_days"],
+        "vesting_time": token_info["vesting_time"]
+    }
+
+
+def _restore_config_cache(cache_path):
+    """
+    Loads _CONFIG_CACHE, _LAST_SYNC and _LAST_FULL_SYNC from the cache file.
+    Returns the file's age in seconds, or None if it is missing, unreadable,
+    from an older cache version, a symlink, or not a private file of the
+    service user.
+    """
+    global _CONFIG_CACHE, _LAST_SYNC, _LAST_FULL_SYNC
+    try:
+        fd = os.open(cache_path, os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return None
+
+    with os.fdopen(fd) as f:
+        st = os.fstat(f.fileno())
+        if st.st_uid != os.getuid() or stat.S_IMODE(st.st_mode) & 0o077:
+            _log.warning("Ignoring config cache %s: not a private file of this user.", cache_path)
+            return None
+        try:
+            data = json.load(f)
+            if data.get("version") != _CONFIG_CACHE_VERSION:
+                return None
+            docs = data["docs"]
+            last_sync = datetime.fromisoformat(data["last_sync"]) if data["last_sync"] else None
+            last_full_sync = float(data["last_full_sync"])
+        except (AttributeError, KeyError, TypeError, ValueError):
+            return None
+
+    _CONFIG_CACHE, _LAST_SYNC, _LAST_FULL_SYNC = docs, last_sync, last_full_sync
+    return time.time() - st.st_mtime
+
+
+def _save_config_cache(cache_path):
+    # Write to a fresh 0600 temp file first so a crash never leaves a half-written
+    # cache; O_EXCL|O_NOFOLLOW refuses to write through anything already there.
+    # The cache is only an optimization, so a failed write (disk full, a
+    # directory in the way...) is logged and the scheduler carries on.
+    tmp_path = f"{cache_path}.tmp"
+    try:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump({
+                "docs": _CONFIG_CACHE,
+                "last_sync": _LAST_SYNC.isoformat() if _LAST_SYNC else None,
+                "last_full_sync": _LAST_FULL_SYNC,
+                "version": _CONFIG_CACHE_VERSION,
+            }, f)
+        os.replace(tmp_path, cache_path)
+    except (OSError, TypeError, ValueError) as e:
+        _log.warning("Could not write config cache %s: %s", cache_path, e)
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+def _sync_vesting_docs(full: bool):
+    """
+    Brings _CONFIG_CACHE up to date with the 'vesting_configs' collection.
+
+    A full sync reads every document. Otherwise only documents with an
+    'updatedAt' newer than _LAST_SYNC are read, and a count() aggregation
+    catches deleted documents (which a delta query can't see) by falling
+    back to a full sync.
+
+    If any document has no 'updatedAt', _LAST_SYNC is left unset so every
+    sync stays full; a delta query could never see edits to that document.
+    """
+    global _CONFIG_CACHE, _LAST_SYNC, _LAST_FULL_SYNC
+    collection = firestore.client().collection("vesting_configs")
+    full = full or _LAST_SYNC is None
+
+    if full:
+        docs = collection.get()
+        _CONFIG_CACHE, _LAST_SYNC = {}, None
+    else:
+        docs = collection.where(
+            filter=firestore.FieldFilter("updatedAt", ">", _LAST_SYNC)
+        ).get()
 
-    docs = db.collection("vesting_configs").stream()
+    unstamped = False
     for doc in docs:
         doc_data = doc.to_dict()
-        vault_id = doc.id
-        tokens = doc_data.get("tokens", [])
-        for token_info in tokens:
-            cfg = {
-                "vault_id":     vault_id,
-                "asset":        token_info["asset"],
-                "ecosystem":    token_info["ecosystem"],
-                "type":         token_info["type"],
-                "chain":        token_info["chain"],
-                "destination":  token_info["destination"],
-                "value":        token_info["value"],
-                "note":         token_info["note"],
-                "cliff_days":   token_info["cliff_days"],
-                "vesting_time": token_info["vesting_time"]
-            }
-            configs.append(cfg)
-
-    return configs
-
-
-def execute_vest_for_asset(cfg: dict):
+        _CONFIG_CACHE[doc.id] = [
+            _token_cfg(doc.id, token_info) for token_info in doc_data.get("tokens", [])
+        ]
+        updated_at = doc_data.get("updatedAt")
+        if updated_at is None:
+            unstamped = True
+        elif _LAST_SYNC is None or updated_at > _LAST_SYNC:
+            _LAST_SYNC = updated_at
+
+    if full:
+        _LAST_FULL_SYNC = time.time()
+        if unstamped:
+            _LAST_SYNC = None
+
+    if not full and collection.count().get()[0][0].value != len(_CONFIG_CACHE):
+        _log.info("Vault documents were added or removed, re-reading the whole collection.")
+        _sync_vesting_docs(full=True)
+        return
+
+    _log.info("Read %d vault documents from Firestore (%s sync).", len(docs), "full" if full else "delta")
+
+
+def load_vesting_configs(force_refresh: bool = False):
+    """
+    Fetches vesting configurations from a Firestore collection named 'vesting_configs'.
+    Returns a list of VestCfg.
+
+    Vault documents are cached in memory and on disk, so a refresh only reads
+    the documents changed since the last sync. On startup, a cache file younger
+    than _CONFIG_CACHE_TTL is restored and brought up to date the same way.
+
+    Every document is re-read when force_refresh is set, on startup without a
+    fresh cache file, and once _FULL_SYNC_INTERVAL has passed since the last
+    full read.
+    """
+    cache_path = _config_cache_path()
+    startup = _LAST_FULL_SYNC is None
+    fresh_cache = False
+    if startup and not force_refresh and cache_path:
+        age = _restore_config_cache(cache_path)
+        fresh_cache = age is not None and age < _CONFIG_CACHE_TTL
+
+    full = (
+        force_refresh
+        or (startup and not fresh_cache)
+        or time.time() - _LAST_FULL_SYNC >= _FULL_SYNC_INTERVAL
+    )
+    _sync_vesting_docs(full=full)
+    if cache_path:
+        _save_config_cache(cache_path)
+
+    return _prepare_configs(_flatten_config_cache())
+
+
+def _flatten_config_cache():
+    # One config per entry of each vault's 'tokens' array, in a single pass
+    return [cfg for cfgs in _CONFIG_CACHE.values() for cfg in cfgs]
+
+
+def execute_vest_for_asset(cfg: VestCfg):
     """
     Execute a single vest for the given asset/config.
     """
-    print(f"\n🔔 It's vesting time for {cfg['asset']} (Vault ID: {cfg['vault_id']})!")
+    _log.info("🔔 It's vesting time for %s (Vault ID: %s)!", cfg.asset, cfg.vault_id)
     try:
-        if cfg["type"] == "native" and cfg["ecosystem"] == "evm" and cfg["value"] != "0":
+        if cfg.type == "native" and cfg.ecosystem == "evm" and cfg.value != "0":
             # Send native EVM token (BNB, ETH, etc.)
             transfer_native_gcp(
-                chain=cfg["chain"],
-                vault_id=cfg["vault_id"],
-                destination=cfg["destination"],
-                value=cfg["value"],
-                note=cfg["note"]
+                chain=cfg.chain,
+                vault_id=cfg.vault_id,
+                destination=cfg.destination,
+                value=cfg.value,
+                note=cfg.note
             )
-        elif cfg["type"] == "erc20" and cfg["ecosystem"] == "evm" and cfg["value"] != "0":
+        elif cfg.type == "erc20" and cfg.ecosystem == "evm" and cfg.value != "0":
             # Send ERC20 token (USDT, USDC, etc.)
             transfer_token_gcp(
-                chain=cfg["chain"],
-                token_ticker=cfg["asset"],
-                vault_id=cfg["vault_id"],
-                destination=cfg["destination"],
-                amount=cfg["value"],
-                note=cfg["note"]
+                chain=cfg.chain,
+                token_ticker=cfg.asset_lower,
+                vault_id=cfg.vault_id,
+                destination=cfg.destination,
+                amount=cfg.value,
+                note=cfg.note
             )
-        elif cfg["value"] == "0":
+        elif cfg.value == "0":
             # If the vesting amount is zero, just inform
-            print(f'❌ Vesting amount for {cfg["asset"]} in Firebase is 0!')
+            _log.warning("❌ Vesting amount for %s in Firebase is 0!", cfg.asset)
         else:
-            raise ValueError(f"Unsupported configuration: type={cfg['type']}, ecosystem={cfg['ecosystem']}")
+            raise ValueError(f"Unsupported configuration: type={cfg.type}, ecosystem={cfg.ecosystem}")
 
-        print(f"✅ {cfg['asset']} vesting completed successfully.")
+        _log.info("✅ %s vesting completed successfully.", cfg.asset)
     except Exception as e:
-        print(f"❌ Error during {cfg['asset']} vesting: {str(e)}")
+        _log.error("❌ Error during %s vesting: %s", cfg.asset, e)
 
 
-def schedule_vesting_for_asset(cfg: dict, tag: str = "vesting"):
+def _prepare_cfg(cfg: dict):
+    """
+    Parses the vesting time once, when the config is loaded, so scheduling
+    only deals with plain ints.
     """
-    We take the vesting time (HH:MM) and cliff_days from cfg, and do the following:
+    vest_hour, vest_minute = map(int, cfg["vesting_time"].split(":"))
+    if not (0 <= vest_hour < 24 and 0 <= vest_minute < 60):
+        raise ValueError(f"vesting_time out of range: {cfg['vesting_time']}")
 
-    1) Compute the local day/time for the very first vest (including cliff_days).
-    2) If that time is already in the past 'today', push it to tomorrow.
-    3) Schedule that job to run daily at vest_hour:vest_minute (local system time).
+    return VestCfg(
+        vault_id=cfg["vault_id"],
+        asset=cfg["asset"],
+        asset_lower=cfg["asset"].strip().lower(),
+        ecosystem=cfg["ecosystem"],
+        type=cfg["type"],
+        chain=cfg["chain"],
+        destination=cfg["destination"],
+        value=cfg["value"],
+        note=cfg["note"],
+        cliff_days=cfg["cliff_days"],
+        vesting_time=cfg["vesting_time"],
+        vest_hour=vest_hour,
+        vest_minute=vest_minute,
+    )
 
-    NOTE: 'schedule' library by default runs on the system's local time -> need to check with GCP
+
+def _prepare_configs(configs: list):
     """
-    vest_hour, vest_minute = map(int, cfg["vesting_time"].split(":"))
+    Runs _prepare_cfg on every raw config dict, logging and dropping the ones with a
+    malformed vesting_time (not a valid HH:MM) so they don't block the rest from being scheduled.
+    """
+    prepared = []
+    for cfg in configs:
+        try:
+            prepared.append(_prepare_cfg(cfg))
+        except ValueError as e:
+            _log.error("❌ Skipping %s (Vault ID: %s): %s", cfg["asset"], cfg["vault_id"], e)
+    return prepared
 
-    # Calculate 'cliff_days' offset from now (in UTC).
-    now_utc = datetime.now(pytz.UTC)
-    first_vest_date_utc = now_utc + timedelta(days=cfg["cliff_days"])
 
-    # Convert from UTC to local server time zone
-    local_tz = pytz.timezone("CET") 
-    first_vest_local = first_vest_date_utc.astimezone(local_tz)
+def run_vest_batch(cfgs: list):
+    """
+    Hands every vest of a time slot to the worker pool, so the transfers run
+    concurrently and the scheduler loop isn't blocked.
+    """
+    for cfg in cfgs:
+        _VEST_POOL.submit(execute_vest_for_asset, cfg)
 
-    # Applies the vest_hour:vest_minute
-    first_vest_local = first_vest_local.replace(
-        hour=vest_hour,
-        minute=vest_minute,
-        second=0,
-        microsecond=0
-    )
 
-    # If we've passed that local time for the day, push to tomorrow
-    now_local = datetime.now(local_tz)
-    if first_vest_local <= now_local:
-        first_vest_local += timedelta(days=1)
+def schedule_vesting_slot(vest_hour: int, vest_minute: int, cfgs: list, tag: str = "vesting"):
+    """
+    Schedules one daily job at vest_hour:vest_minute (CET) that vests every
+    config sharing that time, using the values precomputed by _prepare_cfg.
 
-    # Format the HH:MM in local time for schedule.every().day.at("HH:MM")
-    at_string = first_vest_local.strftime("%H:%M")
+    NOTE: 'schedule' runs on the system's local time unless a timezone is passed
+    to .at(), so we always pass the CET zone and the host time zone doesn't matter.
+    """
+    # Format the HH:MM in CET for schedule.every().day.at("HH:MM", _CET_NAME)
+    at_string = f"{vest_hour:02d}:{vest_minute:02d}"
 
-    # Small function that's calling the vest
-    def daily_vest_job():
-        execute_vest_for_asset(cfg)
+    # Schedule the job every day at the CET time, whatever the host time zone
+    job = schedule.every().day.at(at_string, _CET_NAME).do(run_vest_batch, cfgs).tag(tag)
 
-    # Schedule the job every day at the local time "CET"
-    schedule.every().day.at(at_string).do(daily_vest_job).tag(tag)
+    # job.next_run is naive host-local time; shown in CET, as it will fire
+    next_vest_local = job.next_run.astimezone(_CET)
+    for cfg in cfgs:
+        _log.info(
+            "⏰ %s (Vault ID: %s) vests daily at %s CET, next at %s.",
+            cfg.asset, cfg.vault_id, at_string, next_vest_local
+        )
 
-    print(f"⏰ {cfg['asset']} (Vault ID: {cfg['vault_id']}) first daily vest scheduled for {first_vest_local} local time.")
+    return job
 
 
-def refresh_vesting_schedules():
+def refresh_vesting_schedules(force_refresh: bool = False):
     """
-    Clears out existing vesting jobs, reloads configs, and re-schedules them.
-    We call this daily so that any new config entries are picked up.
+    Reloads configs and re-schedules the time slots whose configs changed,
+    cancelling slots that no longer have any. Unchanged slots keep their job.
+    We call this daily so that any new config entries are picked up; only
+    documents changed since the last sync are read from Firestore.
     """
-    current_time = datetime.now().strftime("%Y-%m-%d %H:%M")
-    print(f"\n--- Refreshing vesting schedules from Firestore at {current_time} ---")
-    schedule.clear('vesting')
+    _log.info("--- Refreshing vesting schedules from Firestore ---")
+
+    # Pick up rotated Fordefi credentials along with the new configs
+    refresh_secrets()
 
-    configs = load_vesting_configs()
-    print(f"Loaded {len(configs)} vesting configs.")
+    configs = load_vesting_configs(force_refresh=force_refresh)
+    _log.info("Loaded %d vesting configs.", len(configs))
 
+    # One job per HH:MM slot rather than one per config
+    by_time = defaultdict(list)
     for cfg in configs:
-        schedule_vesting_for_asset(cfg, tag="vesting")
+        by_time[(cfg.vest_hour, cfg.vest_minute)].append(cfg)
+
+    for slot in [slot for slot in _SCHEDULED if slot not in by_time]:
+        schedule.cancel_job(_SCHEDULED.pop(slot)[1])
+
+    unchanged = 0
+    for (vest_hour, vest_minute), cfgs in by_time.items():
+        slot_cfgs = Counter(cfgs)
+        scheduled = _SCHEDULED.get((vest_hour, vest_minute))
+        if scheduled is not None:
+            if scheduled[0] == slot_cfgs:
+                unchanged += 1
+                continue
+            schedule.cancel_job(scheduled[1])
+
+        job = schedule_vesting_slot(vest_hour, vest_minute, cfgs, tag="vesting")
+        _SCHEDULED[(vest_hour, vest_minute)] = (slot_cfgs, job)
+
+    _log.info("%d vesting time slots scheduled, %d unchanged.", len(_SCHEDULED), unchanged)
 
 
 def main():
-    # 1) Initialize Firebase
-    firebase_admin.initialize_app()
-    print("Firebase initialized successfully!")
+    parser = argparse.ArgumentParser(description="Fordefi vesting scheduler")
+    parser.add_argument(
+        "--force-refresh",
+        action="store_true",
+        help="ignore the local config cache and re-read every config from Firestore",
+    )
+    args = parser.parse_args()
+
+    # Records go through a queue and are written to stderr by a listener thread,
+    # so the scheduler loop and vest workers never block on console output.
+    log_queue = queue.SimpleQueue()
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    log_listener = logging.handlers.QueueListener(log_queue, log_handler)
+    # Not basicConfig: it would give the QueueHandler its own formatter, and
+    # QueueHandler.prepare() would then bake a second prefix into each message.
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    log_listener.start()
+
+    # Everything below runs under try/finally so the vest pool drains and the
+    # queued log records are flushed even when an exception escapes (e.g. a
+    # Firestore or Secret Manager failure during a refresh).
+    try:
+        # 1) Initialize Firebase
+        firebase_admin.initialize_app()
+        _log.info("Firebase initialized successfully!")
+
+        # 2) Initial refresh so we have tasks immediately (may be served from cache)
+        refresh_vesting_schedules(force_refresh=args.force_refresh)
 
-    # 2) Initial refresh so we have tasks immediately
-    refresh_vesting_schedules()
+        # 3) Schedule a daily refresh at 10am CET (using schedule’s time syntax)
+        schedule.every().day.at("10:00", _CET_NAME).do(refresh_vesting_schedules)
 
-    # 3) Schedule a daily refresh at 4pm CET (using schedule’s time syntax)
-    #    This refresh uses the local system time zone.
-    schedule.every().day.at("10:00", "CET").do(refresh_vesting_schedules)
+        # 4) Stop cleanly on SIGTERM (container shutdown) or Ctrl+C
+        signal.signal(signal.SIGTERM, lambda *_: _stop.set())
+        signal.signal(signal.SIGINT, lambda *_: _stop.set())
 
-    # 4) Keep the script alive
-    while True:
-        schedule.run_pending()
-        time.sleep(60)
+        # 5) Keep the script alive, sleeping until the next job is due
+        #    (capped at 60s so jobs added in the meantime are still picked up)
+        while not _stop.is_set():
+            idle = schedule.idle_seconds()
+            if idle is None:
+                break
+            if idle > 0 and _stop.wait(timeout=min(idle, 60)):
+                break
+            schedule.run_pending()
+    finally:
+        # Let vests already handed to the pool finish before exiting
+        _log.info("Shutting down, waiting for running vests to finish...")
+        _VEST_POOL.shutdown(wait=True)
+        log_listener.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+import requests
+import base64
+import json
+import orjson
+import time
+import hashlib
+import uuid
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from signer.api_signer import sign
+from secret_manager.gcp_secret_manager import access_secret
+
+# Shared config for every Fordefi transfer
+GCP_PROJECT_ID = 'inspired-brand-447513-i8'
+FORDEFI_API_USER_TOKEN = 'USER_API_TOKEN'
+TRANSACTIONS_PATH = "/api/v1/transactions"
+# Concurrent vests: vesting_manager's worker pool and the HTTP connection pool
+# below are both sized from this, so no vest waits for a free connection.
+VEST_WORKERS = 8
+
+# Transient failures (connection resets, timeouts, 5xx) are retried with
+# exponential backoff + jitter instead of skipping the vest until the next day.
+# 4xx responses are never retried. Every attempt carries the same
+# x-idempotence-id so Fordefi won't create the transaction twice.
+# total counts retries, so this is at most 5 POST attempts.
+# backoff_max/backoff_jitter need urllib3 >= 2.
+_RETRY = Retry(
+    total=4,
+    backoff_factor=1,
+    backoff_max=60,
+    backoff_jitter=1,
+    status_forcelist=(500, 502, 503, 504),
+    allowed_methods=frozenset({"POST"}),
+    raise_on_status=False,
+)
+_TIMEOUT = (10, 30)  # connect, read (seconds)
+
+# One keep-alive session for every broadcast, so vests reuse TLS connections to
+# api.fordefi.com, with one pooled connection per vest worker.
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=VEST_WORKERS, max_retries=_RETRY))
+
+
+### FUNCTIONS
+def broadcast_tx(path, access_token, signature, timestamp, request_body):
+
+    # The signature covers path|timestamp|body, so it identifies this vest uniquely
+    idempotence_id = uuid.UUID(bytes=hashlib.sha256(signature).digest()[:16], version=4)
+
+    try:
+        resp_tx = _SESSION.post(
+            f"https://api.fordefi.com{path}",
+            headers={
+                "Authorization": f"Bearer {access_token}",
+                "Content-Type": "application/json",
+                "x-signature": base64.b64encode(signature),
+                "x-timestamp": timestamp.encode(),
+                "x-idempotence-id": str(idempotence_id),
+            },
+            data=request_body,
+            timeout=_TIMEOUT,
+        )
+        resp_tx.raise_for_status()
+        return resp_tx
+
+    except requests.exceptions.HTTPError as e:
+        error_message = f"HTTP error occurred: {str(e)}"
+        if resp_tx.text:
+            try:
+                error_detail = resp_tx.json()
+                error_message += f"\nError details: {error_detail}"
+            except json.JSONDecodeError:
+                error_message += f"\nRaw response: {resp_tx.text}"
+        raise RuntimeError(error_message)
+    except requests.exceptions.RequestException as e:
+        raise RuntimeError(f"Network error occurred: {str(e)}")
+
+
+### Core logic
+def submit_transaction(request_json):
+    """
+    Sign a Fordefi transaction request with the API Signer and broadcast it
+
+    Args:
+        request_json (dict): Transaction request body
+
+    Returns:
+        dict: Response from the Fordefi API
+    """
+    USER_API_TOKEN = access_secret(GCP_PROJECT_ID, FORDEFI_API_USER_TOKEN, 'latest')
+    path = TRANSACTIONS_PATH
+
+    # orjson emits bytes directly, so the body is signed and sent as is
+    request_body = orjson.dumps(request_json)
+    timestamp = str(int(time.time()))
+    payload = f"{path}|{timestamp}|".encode() + request_body
+
+    # Sign transaction with API Signer
+    signature = sign(payload=payload, project=GCP_PROJECT_ID)
+
+    # Broadcast tx
+    resp_tx = broadcast_tx(path, USER_API_TOKEN, signature, timestamp, request_body)
+    return resp_tx.json()
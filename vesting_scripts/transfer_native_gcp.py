@@ -1,44 +1,17 @@
-import requests
-import base64
-import json
-import datetime
+import logging
 from decimal import Decimal
-from signer.api_signer import sign
-from secret_manager.gcp_secret_manager import access_secret
+from vesting_scripts.fordefi_api import submit_transaction
 
-### FUNCTIONS
-def broadcast_tx(path, access_token, signature, timestamp, request_body):
-
-    try:
-        resp_tx = requests.post(
-            f"https://api.fordefi.com{path}",
-            headers={
-                "Authorization": f"Bearer {access_token}",
-                "x-signature": base64.b64encode(signature),
-                "x-timestamp": timestamp.encode(),
-            },
-            data=request_body,
-        )
-        resp_tx.raise_for_status()
-        return resp_tx
+_log = logging.getLogger(__name__)
 
-    except requests.exceptions.HTTPError as e:
-        error_message = f"HTTP error occurred: {str(e)}"
-        if resp_tx.text:
-            try:
-                error_detail = resp_tx.json()
-                error_message += f"\nError details: {error_detail}"
-            except json.JSONDecodeError:
-                error_message += f"\nRaw response: {resp_tx.text}"
-        raise RuntimeError(error_message)
-    except requests.exceptions.RequestException as e:
-        raise RuntimeError(f"Network error occurred: {str(e)}")
+WEI_PER_NATIVE = 10**18
 
 
+### FUNCTIONS
 def evm_tx_native(evm_chain, vault_id, destination, custom_note, value):
 
-    value_in_wei = str(int(Decimal(value) * Decimal('1000000000000000000')))
-    print(f"⚙️ Preparing tx for {value}!")
+    value_in_wei = str(int(Decimal(value) * WEI_PER_NATIVE))
+    _log.info("⚙️ Preparing tx for %s!", value)
 
     """
     Native ETH or BNB transfer
@@ -88,12 +61,6 @@ def transfer_native_gcp(chain, vault_id, destination, value, note):
     Returns:
         dict: Response from the Fordefi API
     """
-    # Set config
-    GCP_PROJECT_ID = 'inspired-brand-447513-i8'
-    FORDEFI_API_USER_TOKEN = 'USER_API_TOKEN'
-    USER_API_TOKEN = access_secret(GCP_PROJECT_ID, FORDEFI_API_USER_TOKEN, 'latest')
-    path = "/api/v1/transactions"
-
     # Building transaction
     request_json = evm_tx_native(
         evm_chain=chain,
@@ -102,13 +69,5 @@ def transfer_native_gcp(chain, vault_id, destination, value, note):
         custom_note=note,
         value=value
     )
-    request_body = json.dumps(request_json)
-    timestamp = datetime.datetime.now().strftime("%s")
-    payload = f"{path}|{timestamp}|{request_body}"
-
-    # Sign transaction with API Signer
-    signature = sign(payload=payload, project=GCP_PROJECT_ID)
 
-    # Broadcast tx
-    resp_tx = broadcast_tx(path, USER_API_TOKEN, signature, timestamp, request_body)
-    return resp_tx.json()
\ No newline at end of file
+    return submit_transaction(request_json)
@@ -1,78 +1,33 @@
-import requests
-import base64
-import json
-import datetime
+import logging
 from decimal import Decimal
-from signer.api_signer import sign
-from secret_manager.gcp_secret_manager import access_secret
+from vesting_scripts.fordefi_api import submit_transaction
 
+_log = logging.getLogger(__name__)
 
-### FUNCTIONS
-def broadcast_tx(path, access_token, signature, timestamp, request_body):
-
-    try:
-        resp_tx = requests.post(
-            f"https://api.fordefi.com{path}",
-            headers={
-                "Authorization": f"Bearer {access_token}",
-                "x-signature": base64.b64encode(signature),
-                "x-timestamp": timestamp.encode(),
-            },
-            data=request_body,
-        )
-        resp_tx.raise_for_status()
-        return resp_tx
 
-    except requests.exceptions.HTTPError as e:
-        error_message = f"HTTP error occurred: {str(e)}"
-        if resp_tx.text:
-            try:
-                error_detail = resp_tx.json()
-                error_message += f"\nError details: {error_detail}"
-            except json.JSONDecodeError:
-                error_message += f"\nRaw response: {resp_tx.text}"
-        raise RuntimeError(error_message)
-    except requests.exceptions.RequestException as e:
-        raise RuntimeError(f"Network error occurred: {str(e)}")
+# (chain, token) -> (contract address, 10**decimals)
+_TOKEN_TABLE = {
+    ("bsc", "usdt"):          ("0x55d398326f99059fF775485246999027B3197955", 10**18),
+    ("bsc", "btcb"):          ("0x7130d2A12B9BCbFAe4f2634d864A1Ee1Ce3Ead9c", 10**18),
+    ("bsc", "monky"):         ("0x59E69094398AfbEA632F8Bd63033BdD2443a3Be1", 10**18),
+    ("bsc", "cake"):          ("0x0E09FaBB73Bd3Ade0a17ECC321fD13a19e81cE82", 10**18),
+    ("ethereum", "usdt"):     ("0xdAC17F958D2ee523a2206206994597C13D831ec7", 10**6),
+    ("ethereum", "pepe"):     ("0x6982508145454Ce325dDbE47a25d4ec3d2311933", 10**18),
+    ("ethereum", "basedai"):  ("0x44971ABF0251958492FeE97dA3e5C5adA88B9185", 10**18),
+}
 
 
+### FUNCTIONS
 def evm_tx_tokens(evm_chain, vault_id, destination, custom_note, value, token):
 
     sanitized_token_name = token.lower().strip()
-    print(f"Preparing to send {value} {sanitized_token_name}")
+    _log.info("Preparing to send %s %s", value, sanitized_token_name)
 
-    value_eighteen_decimal_tokens = str(int(Decimal(value) * Decimal('1000000000000000000'))) # 18 decimals
-    value_six_decimal_tokens =  str(int(Decimal(value) * Decimal('1000000')))  # 6 decimals
-
-    if evm_chain == "bsc":
-        if sanitized_token_name == "usdt":
-            contract_address = "0x55d398326f99059fF775485246999027B3197955"
-            value = value_eighteen_decimal_tokens
-        elif sanitized_token_name == "btcb":
-            contract_address = "0x7130d2A12B9BCbFAe4f2634d864A1Ee1Ce3Ead9c"
-            value = value_eighteen_decimal_tokens
-        elif sanitized_token_name == "monky":
-            contract_address = "0x59E69094398AfbEA632F8Bd63033BdD2443a3Be1"
-            value = value_eighteen_decimal_tokens
-        elif sanitized_token_name == "cake":
-            contract_address = "0x0E09FaBB73Bd3Ade0a17ECC321fD13a19e81cE82"
-            value = value_eighteen_decimal_tokens
-        else:
-            raise ValueError(f"Token '{token}' is not supported for chain '{evm_chain}'") 
-    elif evm_chain == "ethereum":
-        if sanitized_token_name == "usdt":
-            contract_address = "0xdAC17F958D2ee523a2206206994597C13D831ec7"
-            value = value_six_decimal_tokens 
-        elif sanitized_token_name == "pepe":
-            contract_address = "0x6982508145454Ce325dDbE47a25d4ec3d2311933"
-            value = value_eighteen_decimal_tokens
-        elif sanitized_token_name == "basedai":
-            contract_address = "0x44971ABF0251958492FeE97dA3e5C5adA88B9185"
-            value = value_eighteen_decimal_tokens
-        else:
-            raise ValueError(f"Token '{token}' is not supported for chain '{evm_chain}'") 
-    else:
-        raise ValueError(f"Token '{token}' is not supported for chain '{evm_chain}'")
+    try:
+        contract_address, scale = _TOKEN_TABLE[(evm_chain, sanitized_token_name)]
+    except KeyError:
+        raise ValueError(f"Token '{token}' is not supported for chain '{evm_chain}'") from None
+    value = str(int(Decimal(value) * scale))
 
     request_json =  {
     "signer_type": "api_signer",
@@ -121,12 +76,6 @@ def transfer_token_gcp(chain, token_ticker, vault_id, destination, amount, note)
     Returns:
         dict: Response from the Fordefi API
     """
-    # Set config
-    GCP_PROJECT_ID = 'inspired-brand-447513-i8'
-    FORDEFI_API_USER_TOKEN = 'USER_API_TOKEN'
-    USER_API_TOKEN = access_secret(GCP_PROJECT_ID, FORDEFI_API_USER_TOKEN, 'latest')
-    path = "/api/v1/transactions"
-
     # Building transaction
     request_json = evm_tx_tokens(
         evm_chain=chain,
@@ -136,13 +85,5 @@ def transfer_token_gcp(chain, token_ticker, vault_id, destination, amount, note)
         value=amount,
         token=token_ticker
     )
-    request_body = json.dumps(request_json)
-    timestamp = datetime.datetime.now().strftime("%s")
-    payload = f"{path}|{timestamp}|{request_body}"
-
-    # Sign transaction with API Signer
-    signature = sign(payload=payload, project=GCP_PROJECT_ID)
 
-    # Broadcast tx
-    resp_tx = broadcast_tx(path, USER_API_TOKEN, signature, timestamp, request_body)
-    return resp_tx.json()
+    return submit_transaction(request_json)